@@ -0,0 +1,413 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from headless import HeadlessGame
+
+# Plays lots of headless games with a bot on every core to see how changes to the game data
+# tables play out. Every job gets its own seed and its own overrides, e.g.
+#   python batch_sim.py --runs 50 --set WAVE_PROPERTIES.5.amount=40,60,80
+# plays 50 seeds for each of the three values. One row per game is written to the csv as
+# soon as it finishes, one row per wave of every game to a second csv, and a summary per
+# combination is printed at the end.
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(GAME_DIR, "batch_results.csv")
+DEFAULT_WAVE_OUTPUT = os.path.join(GAME_DIR, "batch_waves.csv")
+
+# only these get copied into the game when an enemy spawns or a wave starts, so
+# overriding them always takes effect
+TUNABLE_TABLES = ("WAVE_PROPERTIES", "ENEMY_TYPES", "UPGRADE_PROPERTIES")
+WAVE_COUNT = 5
+MAX_TICKS = 60 * 60 * 10
+WAVE_STATS = ("clear_s", "damage", "ttk_s")
+
+# the kite bot runs circles this far around the middle of the screen, away from the edges
+# where the enemies come in. It's faster than any of them, so the crowd trails behind it.
+# Anything closer than the danger radius pushes it off the circle, the closer the harder
+KITE_CIRCLE_RADIUS = 220
+KITE_DANGER_RADIUS = 200
+# keys for each 45 degree sector, going clockwise from right (y points down)
+KITE_KEYS = (("D",), ("D", "S"), ("S",), ("A", "S"), ("A",), ("A", "W"), ("W",), ("D", "W"))
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_override(text):
+    # "TABLE.key.key=value1,value2" -> ("TABLE.key.key", [value1, value2])
+    path, _, values = text.partition("=")
+    if not values or path.split(".")[0] not in TUNABLE_TABLES:
+        raise argparse.ArgumentTypeError(
+            f"expected TABLE.key...=value[,value...] with TABLE one of {TUNABLE_TABLES}"
+        )
+    return path, [parse_value(value) for value in values.split(",")]
+
+
+class WatchedTable(dict):
+    # a table the game reads the overridden values from. Whenever one of them is read its
+    # path goes into used, so a sweep over something no game ever gets to can be told apart
+    def __init__(self, table, used):
+        super().__init__(table)
+        self.used = used
+        self.watched = {}
+
+    def __getitem__(self, key):
+        path = self.watched.get(key)
+        if path is not None:
+            self.used.add(path)
+        return super().__getitem__(key)
+
+
+def apply_override(module, path, value, used=None):
+    table_name, *keys = path.split(".")
+    table = getattr(module, table_name)
+    parent = parent_key = None
+    for depth, key in enumerate(keys):
+        # wave numbers are ints in the table, everything else is a string
+        if key.isdigit() and int(key) in table:
+            key = int(key)
+        if key not in table:
+            raise KeyError(f"{path}: no {key!r} in {table_name}")
+        if depth < len(keys) - 1:
+            parent, parent_key = table, key
+            table = table[key]
+            continue
+        if used is not None:
+            if not isinstance(table, WatchedTable):
+                table = WatchedTable(table, used)
+                if parent is None:
+                    setattr(module, table_name, table)
+                else:
+                    parent[parent_key] = table
+            table.watched[key] = path
+        table[key] = value
+
+
+def nearest_enemy(game_manager):
+    player = game_manager.player
+    nearest = None
+    nearest_distance = math.inf
+    for enemy in game_manager.enemies:
+        if enemy.current_health <= 0:
+            continue
+        distance = (enemy.x - player.x) ** 2 + (enemy.y - player.y) ** 2
+        if distance < nearest_distance:
+            nearest = enemy
+            nearest_distance = distance
+    return nearest
+
+
+def aim_bot(game):
+    nearest = nearest_enemy(game.game_manager)
+    if nearest is not None:
+        game.aim(nearest.pos)
+
+
+def kite_bot(game):
+    aim_bot(game)
+    game_manager = game.game_manager
+    player = game_manager.player
+    module = game.module
+
+    # clockwise round the middle, drifting back onto the circle when it's off it
+    from_middle_x = player.x - module.WIDTH / 2
+    from_middle_y = player.y - module.HEIGHT / 2
+    distance = math.hypot(from_middle_x, from_middle_y) or 1
+    drift = (KITE_CIRCLE_RADIUS - distance) / KITE_CIRCLE_RADIUS
+    push_x = (drift * from_middle_x - from_middle_y) / distance
+    push_y = (drift * from_middle_y + from_middle_x) / distance
+    for enemy in game_manager.enemies:
+        if enemy.current_health <= 0:
+            continue
+        dx = player.x - enemy.x
+        dy = player.y - enemy.y
+        distance = math.hypot(dx, dy)
+        if 0 < distance < KITE_DANGER_RADIUS:
+            # cubed, so one enemy right next to it outweighs the circle and the crowd
+            weight = (KITE_DANGER_RADIUS / distance) ** 3 / distance
+            push_x += dx * weight
+            push_y += dy * weight
+
+    keyboard = game.keyboard
+    keyboard.pressed.clear()
+    if push_x == 0 and push_y == 0:
+        return
+    # the push points somewhere in a circle, the keys can only do 8 directions of it
+    angle = math.atan2(push_y, push_x)
+    sector = round(angle / (math.pi / 4)) % 8
+    for key in KITE_KEYS[sector]:
+        keyboard.press(key)
+
+
+BOTS = {"aim": aim_bot, "kite": kite_bot}
+
+
+def pick_upgrade(upgrades, policy, rng):
+    if policy == "random":
+        return rng.randrange(len(upgrades))
+    if policy != "first":
+        # anything else names the upgrade type the bot goes for whenever it's offered
+        for index, upgrade in enumerate(upgrades):
+            if upgrade.type == policy:
+                return index
+    return 0
+
+
+def run_job(job):
+    started = time.perf_counter()
+    game = HeadlessGame(job["seed"])
+    used = set()
+    for path, value in job["overrides"].items():
+        apply_override(game.module, path, value, used)
+    game.start(job["endless"])
+    game_manager = game.game_manager
+    bot = BOTS[job["bot"]]
+    # the bot's own choices get their own rng, so they don't shift the game's rolls
+    bot_rng = random.Random(job["seed"])
+
+    wave_started = 0
+    wave_damage = 0
+    health = game_manager.player.current_health
+    spawned = {}
+    kill_times = []
+    waves = {}
+    upgrades_taken = []
+
+    while game.ticks < job["max_ticks"] and not game_manager.game_over:
+        wave_manager = game_manager.wave_manager
+        if wave_manager.intermission:
+            upgrades = wave_manager.upgrades
+            upgrade = upgrades[pick_upgrade(upgrades, job["upgrades"], bot_rng)]
+            upgrades_taken.append(f"{upgrade.type}:{upgrade.rarity}")
+            game.module.on_mouse_down(upgrade.pos)
+            wave_started = game.ticks
+            wave_damage = 0
+            spawned.clear()
+            kill_times = []
+            health = game_manager.player.current_health
+
+        wave = wave_manager.current_wave
+        bot(game)
+        game.step()
+
+        player = game_manager.player
+        if player.current_health < health:
+            wave_damage += health - player.current_health
+        health = player.current_health
+        # enemies are pooled, so one is only "new" while we haven't seen it alive yet
+        for enemy in game_manager.enemies:
+            key = id(enemy)
+            if enemy.current_health > 0:
+                spawned.setdefault(key, game.ticks)
+            elif key in spawned:
+                kill_times.append(game.ticks - spawned.pop(key))
+
+        if wave_manager.intermission or game_manager.game_over:
+            cleared = game_manager.player.current_health > 0
+            waves[wave] = {
+                "clear_s": (
+                    (game.ticks - wave_started) * game.tick_length if cleared else None
+                ),
+                "damage": wave_damage,
+                "ttk_s": (
+                    sum(kill_times) / len(kill_times) * game.tick_length
+                    if kill_times
+                    else None
+                ),
+            }
+
+    player = game_manager.player
+    result = {
+        "job": job["job"],
+        "seed": job["seed"],
+        "bot": job["bot"],
+        "upgrades": job["upgrades"],
+    }
+    result.update(job["overrides"])
+    result.update(
+        {
+            "won": int(game_manager.game_over and player.current_health > 0),
+            "wave_reached": game_manager.wave_manager.current_wave,
+            "game_s": round(game.ticks * game.tick_length, 3),
+            "damage_taken": sum(wave["damage"] for wave in waves.values()),
+            "upgrades_taken": " ".join(upgrades_taken),
+            "overrides_read": " ".join(sorted(used)),
+            "sim_s": round(time.perf_counter() - started, 3),
+        }
+    )
+    wave_rows = []
+    for wave in sorted(waves):
+        row = {"job": job["job"], "seed": job["seed"], "wave": wave}
+        row.update(job["overrides"])
+        for name in WAVE_STATS:
+            value = waves[wave][name]
+            row[name] = "" if value is None else round(value, 3)
+        wave_rows.append(row)
+    for wave in range(1, WAVE_COUNT + 1):
+        stats = waves.get(wave, {})
+        for name in WAVE_STATS:
+            value = stats.get(name)
+            result[f"wave{wave}_{name}"] = "" if value is None else round(value, 3)
+    return result, wave_rows
+
+
+def build_jobs(args):
+    paths = [path for path, _ in args.set]
+    jobs = []
+    for values in itertools.product(*(values for _, values in args.set)):
+        overrides = dict(zip(paths, values))
+        for run in range(args.runs):
+            jobs.append(
+                {
+                    "job": len(jobs),
+                    # same seeds for every combination, so they're compared on the same runs
+                    "seed": args.seed + run,
+                    "overrides": overrides,
+                    "bot": args.bot,
+                    "upgrades": args.upgrades,
+                    "endless": args.endless,
+                    "max_ticks": args.max_ticks,
+                }
+            )
+    return jobs
+
+
+def result_columns(paths):
+    columns = ["job", "seed", "bot", "upgrades", *paths]
+    columns += ["won", "wave_reached", "game_s", "damage_taken", "upgrades_taken"]
+    columns += ["overrides_read", "sim_s"]
+    for wave in range(1, WAVE_COUNT + 1):
+        columns += [f"wave{wave}_{name}" for name in WAVE_STATS]
+    return columns
+
+
+def wave_columns(paths):
+    # every wave played, endless ones included
+    return ["job", "seed", *paths, "wave", *WAVE_STATS]
+
+
+def summarize(results, wave_rows, paths, endless):
+    groups = {}
+    for result in results:
+        key = tuple(json.dumps(result[path]) for path in paths)
+        groups.setdefault(key, []).append(result)
+    wave_groups = {}
+    for row in wave_rows:
+        key = tuple(json.dumps(row[path]) for path in paths)
+        wave_groups.setdefault(key, {}).setdefault(row["wave"], []).append(row)
+    for key, group in sorted(groups.items()):
+        label = " ".join(f"{path}={value}" for path, value in zip(paths, key)) or "defaults"
+        wins = sum(result["won"] for result in group)
+        waves = sum(result["wave_reached"] for result in group) / len(group)
+        damage = sum(result["damage_taken"] for result in group) / len(group)
+        print(
+            f"{label:<50} runs {len(group):>5}  win rate {wins / len(group):6.1%}"
+            f"  avg wave {waves:4.2f}  avg damage taken {damage:6.2f}"
+        )
+        if not endless:
+            continue
+        # endless has no last wave, so how far the runs got is best seen wave by wave
+        for wave, rows in sorted(wave_groups.get(key, {}).items()):
+            cleared = [row["clear_s"] for row in rows if row["clear_s"] != ""]
+            damage = sum(row["damage"] for row in rows) / len(rows)
+            clear = f"{sum(cleared) / len(cleared):6.1f}s" if cleared else "      -"
+            print(
+                f"  wave {wave:>3}  played {len(rows):>5}  cleared {len(cleared):>5}"
+                f"  avg clear {clear}  avg damage taken {damage:6.2f}"
+            )
+    # a value only matters if the game gets to it, e.g. a wave the bot never reaches
+    read = set()
+    for result in results:
+        read.update(result["overrides_read"].split())
+    for path in paths:
+        if path not in read:
+            print(
+                f"warning: no game ever read {path}, every value of it played the same."
+                " Did the bot get that far?"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance sweeps over the game tables.")
+    parser.add_argument("--runs", type=int, default=20, help="seeds per combination")
+    parser.add_argument("--seed", type=int, default=1, help="first seed")
+    parser.add_argument(
+        "--set",
+        type=parse_override,
+        action="append",
+        default=[],
+        metavar="TABLE.KEY=V1,V2",
+        help="values to sweep, can be given more than once for a grid",
+    )
+    parser.add_argument("--bot", choices=sorted(BOTS), default="kite")
+    parser.add_argument(
+        "--upgrades",
+        default="random",
+        help="random, first, or an upgrade type the bot always takes when offered",
+    )
+    parser.add_argument(
+        "--endless",
+        action="store_true",
+        help="play endless mode, every game then runs until death or --max-ticks",
+    )
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--wave-output", default=DEFAULT_WAVE_OUTPUT)
+    args = parser.parse_args()
+
+    # catch typos in the override paths here instead of in every worker
+    module = HeadlessGame().module
+    for path, values in args.set:
+        try:
+            apply_override(module, path, values[0])
+        except (KeyError, TypeError) as error:
+            parser.error(str(error))
+
+    jobs = build_jobs(args)
+    paths = [path for path, _ in args.set]
+    print(f"{len(jobs)} games on {args.workers} workers")
+
+    started = time.perf_counter()
+    results = []
+    wave_rows = []
+    with open(args.output, "w", newline="") as file, open(
+        args.wave_output, "w", newline=""
+    ) as wave_file:
+        writer = csv.DictWriter(file, result_columns(paths))
+        writer.writeheader()
+        wave_writer = csv.DictWriter(wave_file, wave_columns(paths))
+        wave_writer.writeheader()
+        with multiprocessing.Pool(args.workers) as pool:
+            for result, rows in pool.imap_unordered(run_job, jobs):
+                writer.writerow(result)
+                wave_writer.writerows(rows)
+                file.flush()
+                wave_file.flush()
+                results.append(result)
+                wave_rows += rows
+                if len(results) % 50 == 0:
+                    print(f"  {len(results)}/{len(jobs)}", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"done in {elapsed:.1f}s, results written to {args.output}"
+        f" and per wave to {args.wave_output}"
+    )
+    summarize(results, wave_rows, paths, args.endless)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+import argparse
+import gc
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+from headless import HeadlessGame
+from replay import apply_tick
+
+# Scripted stress scenarios for update() and draw(). Every scenario runs twice: once to
+# time the frames and once under tracemalloc to see how much each frame allocates (tracing
+# slows everything down, so the two are kept apart). Results go to a json file, and if a
+# thresholds file is given any metric over its baseline times the margin fails the run.
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(GAME_DIR, "benchmark_results.json")
+DEFAULT_THRESHOLDS = os.path.join(GAME_DIR, "benchmark_thresholds.json")
+
+ENEMY_AMOUNT = 200
+PROJECTILE_AMOUNT = 500
+# only run when projectiles live in the numpy store, as Actors this would take minutes
+SWARM_PROJECTILE_AMOUNT = 20000
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[max(index, 0)]
+
+
+def make_invincible(game):
+    game.game_manager.player.current_health = math.inf
+
+
+def freeze_waves(game):
+    # drop the spawn and wave timers so only what the scenario puts in the arena exists
+    game.game_manager.timers.cancel_owner(game.game_manager.wave_manager)
+
+
+def place_in_ring(game, index, amount, radius):
+    angle = 2 * math.pi * index / amount
+    player = game.game_manager.player
+    return (player.x + math.cos(angle) * radius, player.y + math.sin(angle) * radius)
+
+
+def aim_at_nearest_enemy(game):
+    game_manager = game.game_manager
+    player = game_manager.player
+    nearest = None
+    nearest_distance = math.inf
+    for enemy in game_manager.enemies:
+        if enemy.current_health <= 0:
+            continue
+        distance = (enemy.x - player.x) ** 2 + (enemy.y - player.y) ** 2
+        if distance < nearest_distance:
+            nearest = enemy
+            nearest_distance = distance
+    if nearest is not None:
+        game.aim(nearest.pos)
+
+
+class Scenario:
+    def __init__(
+        self,
+        name,
+        setup,
+        frames,
+        before_frame=None,
+        until_game_over=False,
+        seed=None,
+        endless=False,
+    ):
+        self.name = name
+        self.setup = setup
+        self.frames = frames
+        self.before_frame = before_frame
+        self.until_game_over = until_game_over
+        # a recording brings its own seed, everything else uses the one from the command line
+        self.seed = seed
+        self.endless = endless
+
+
+def enemies_scenario(enemy_type, frames):
+    def setup(game):
+        make_invincible(game)
+        freeze_waves(game)
+        # the player can't hurt them, so the crowd stays the same size the whole time
+        game.game_manager.player.damage = 0
+        wave_manager = game.game_manager.wave_manager
+        for index in range(ENEMY_AMOUNT):
+            wave_manager.add_enemy(enemy_type, place_in_ring(game, index, ENEMY_AMOUNT, 600))
+
+    return Scenario(f"enemies_{enemy_type}", setup, frames)
+
+
+def top_up_projectiles(game, amount):
+    game_manager = game.game_manager
+    player = game_manager.player
+    rng = game_manager.rng
+    while len(game_manager.projectiles) < amount:
+        angle = rng.uniform(0, 2 * math.pi)
+        game_manager.spawn_projectile(
+            player.pos,
+            player.shot_speed,
+            [math.cos(angle), math.sin(angle)],
+            player.damage,
+        )
+
+
+def projectiles_scenario(frames):
+    def setup(game):
+        make_invincible(game)
+        freeze_waves(game)
+        game.game_manager.player.can_shoot = False
+
+    def top_up(game):
+        top_up_projectiles(game, PROJECTILE_AMOUNT)
+
+    return Scenario("projectiles", setup, frames, before_frame=top_up)
+
+
+def projectile_swarm_scenario(frames):
+    def setup(game):
+        make_invincible(game)
+        freeze_waves(game)
+        game_manager = game.game_manager
+        game_manager.player.can_shoot = False
+        wave_manager = game_manager.wave_manager
+        for index in range(ENEMY_AMOUNT):
+            wave_manager.add_enemy("cat", place_in_ring(game, index, ENEMY_AMOUNT, 300))
+
+    def top_up(game):
+        # the ring of enemies soaks up the fire and heals back, so it never breaks
+        for enemy in game.game_manager.enemies:
+            if enemy.current_health > 0:
+                enemy.change_current_health(enemy.max_health - enemy.current_health)
+        top_up_projectiles(game, SWARM_PROJECTILE_AMOUNT)
+
+    return Scenario("projectile_swarm", setup, frames, before_frame=top_up)
+
+
+def max_firerate_scenario(frames):
+    def setup(game):
+        make_invincible(game)
+        game.game_manager.player.firerate = 0
+
+    return Scenario("max_firerate", setup, frames, before_frame=aim_at_nearest_enemy)
+
+
+def play_with_bot(game):
+    wave_manager = game.game_manager.wave_manager
+    if wave_manager.intermission and wave_manager.upgrades:
+        game.choose_upgrade(0)
+    aim_at_nearest_enemy(game)
+
+
+def full_run_scenario(frames):
+    def setup(game):
+        make_invincible(game)
+
+    return Scenario(
+        "full_run", setup, frames, before_frame=play_with_bot, until_game_over=True
+    )
+
+
+def recording_scenario(path, recording):
+    def setup(game):
+        game.game_manager.controls.locked = True
+
+    def play(game):
+        game.tick_length = apply_tick(game, recording.ticks[game.ticks])
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Scenario(
+        f"replay_{name}",
+        setup,
+        len(recording.ticks),
+        before_frame=play,
+        seed=recording.seed,
+        endless=recording.endless,
+    )
+
+
+def snapshot_scenario(path, snapshot, frames):
+    # starts right where the snapshot was taken, e.g. a wave 5 crowd, then plays on like
+    # full_run
+    def setup(game):
+        game.restore(snapshot)
+        make_invincible(game)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Scenario(f"snapshot_{name}", setup, frames, before_frame=play_with_bot)
+
+
+def build_scenarios(module, frames):
+    scenarios = [
+        enemies_scenario(enemy_type, frames) for enemy_type in module.ENEMY_TYPES
+    ]
+    scenarios.append(projectiles_scenario(frames))
+    if module.USE_PROJECTILE_STORE:
+        scenarios.append(projectile_swarm_scenario(frames))
+    scenarios.append(max_firerate_scenario(frames))
+    # the whole 5 waves take a bit over 3 minutes of game time
+    scenarios.append(full_run_scenario(60 * 60 * 5))
+    return scenarios
+
+
+def play_scenario(scenario, seed, render, governor, frame_callback):
+    if scenario.seed is not None:
+        seed = scenario.seed
+    game = HeadlessGame(seed, render=render)
+    # with the governor off every frame runs at full quality, so the timings compare
+    game.game_manager.quality.enabled = governor
+    game.start(scenario.endless)
+    scenario.setup(game)
+    for _ in range(scenario.frames):
+        if scenario.until_game_over and game.game_manager.game_over:
+            break
+        if scenario.before_frame is not None:
+            scenario.before_frame(game)
+        frame_callback(game)
+    return game
+
+
+def time_scenario(scenario, seed, render, governor):
+    update_times = []
+    draw_times = []
+    gc_pauses = []
+    gc_started = [0]
+
+    def on_gc(phase, info):
+        if phase == "start":
+            gc_started[0] = time.perf_counter_ns()
+        else:
+            gc_pauses.append(time.perf_counter_ns() - gc_started[0])
+
+    def frame(game):
+        started = time.perf_counter_ns()
+        game.step()
+        updated = time.perf_counter_ns()
+        update_times.append((updated - started) / 1e6)
+        if render:
+            game.draw()
+            draw_times.append((time.perf_counter_ns() - updated) / 1e6)
+
+    gc.callbacks.append(on_gc)
+    try:
+        game = play_scenario(scenario, seed, render, governor, frame)
+    finally:
+        gc.callbacks.remove(on_gc)
+
+    result = {"frames": len(update_times)}
+    for name, times in (("update", update_times), ("draw", draw_times)):
+        if not times:
+            continue
+        result[f"{name}_p50_ms"] = percentile(times, 50)
+        result[f"{name}_p95_ms"] = percentile(times, 95)
+        result[f"{name}_p99_ms"] = percentile(times, 99)
+    result["gc_collections"] = len(gc_pauses)
+    result["gc_pause_max_ms"] = max(gc_pauses, default=0) / 1e6
+    # a replayed run can end in a restart, back on the menu with no waves
+    wave_manager = game.game_manager.wave_manager
+    result["wave_reached"] = wave_manager.current_wave if wave_manager else None
+    projectiles = game.game_manager.projectile_store
+    if projectiles is None:
+        projectiles = game.game_manager.projectile_pool
+    result["projectile_pool_high_water_mark"] = projectiles.high_water_mark
+    result["enemy_pool_high_water_mark"] = game.game_manager.enemy_pool.high_water_mark
+    if governor:
+        result["quality_level_seconds"] = [
+            round(seconds, 3) for seconds in game.game_manager.quality.level_time
+        ]
+    return result
+
+
+def measure_memory(scenario, seed, render, governor):
+    allocated = []
+    blocks = []
+
+    def frame(game):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        block_count = sys.getallocatedblocks()
+        game.step()
+        if render:
+            game.draw()
+        _, peak = tracemalloc.get_traced_memory()
+        # how far memory rose during the frame, so temporary objects are counted too
+        allocated.append(peak - current)
+        blocks.append(sys.getallocatedblocks() - block_count)
+
+    tracemalloc.start()
+    try:
+        play_scenario(scenario, seed, render, governor, frame)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "alloc_bytes_per_frame_p50": percentile(allocated, 50),
+        "alloc_bytes_per_frame_p99": percentile(allocated, 99),
+        "net_blocks_per_frame": sum(blocks) / max(len(blocks), 1),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def limit_for(thresholds, metric, baseline):
+    # timings are noisy and vary from one machine to the next, byte counts hardly move
+    kind = "ms" if metric.endswith("_ms") else "bytes"
+    return baseline * thresholds["margins"][kind]
+
+
+def check_thresholds(results, thresholds):
+    failures = []
+    for scenario_name, baselines in thresholds["baselines"].items():
+        scenario_results = results.get(scenario_name)
+        if scenario_results is None:
+            continue
+        for metric, baseline in baselines.items():
+            limit = limit_for(thresholds, metric, baseline)
+            value = scenario_results.get(metric)
+            if value is not None and value > limit:
+                failures.append(
+                    f"{scenario_name}.{metric} = {value:.3f}"
+                    f" (limit {limit:.3f}, baseline {baseline})"
+                )
+    return failures
+
+
+def save_baselines(results, thresholds):
+    # only the metrics that are already checked, for the scenarios that just ran
+    for scenario_name, baselines in thresholds["baselines"].items():
+        scenario_results = results.get(scenario_name, {})
+        for metric in baselines:
+            if metric in scenario_results:
+                baselines[metric] = round(scenario_results[metric], 3)
+
+
+def can_render():
+    try:
+        import pygame  # noqa: F401
+        import pgzero  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame-time stress scenarios.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--only", help="comma separated scenario names")
+    parser.add_argument("--no-render", action="store_true", help="skip timing draw()")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument(
+        "--governor",
+        action="store_true",
+        help="let the quality governor lower the quality when frames run over budget",
+    )
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="write this run's numbers into the thresholds file as the new baselines",
+    )
+    parser.add_argument(
+        "--recording",
+        action="append",
+        default=[],
+        help="also replay this recorded run as a scenario, can be given more than once",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="append",
+        default=[],
+        help="also play on from this snapshot, can be given more than once",
+    )
+    args = parser.parse_args()
+
+    render = not args.no_render and can_render()
+    if not render and not args.no_render:
+        print("pygame/pgzero not found, only update() will be timed")
+
+    # a throwaway game just to read the enemy types from main.py
+    module = HeadlessGame().module
+    scenarios = build_scenarios(module, args.frames)
+    if args.only:
+        wanted = set(args.only.split(","))
+        scenarios = [scenario for scenario in scenarios if scenario.name in wanted]
+    for path in args.recording:
+        scenarios.append(recording_scenario(path, module.load_recording(path)))
+    for path in args.snapshot:
+        with open(path, "rb") as file:
+            scenarios.append(snapshot_scenario(path, file.read(), args.frames))
+
+    results = {}
+    for scenario in scenarios:
+        result = time_scenario(scenario, args.seed, render, args.governor)
+        if not args.no_memory:
+            result.update(measure_memory(scenario, args.seed, render, args.governor))
+        results[scenario.name] = result
+        summary = f"{scenario.name:<20} {result['frames']:>6} frames"
+        summary += f"  update p50/p95/p99 {result['update_p50_ms']:.3f}"
+        summary += f"/{result['update_p95_ms']:.3f}/{result['update_p99_ms']:.3f} ms"
+        if render:
+            summary += f"  draw p50/p95/p99 {result['draw_p50_ms']:.3f}"
+            summary += f"/{result['draw_p95_ms']:.3f}/{result['draw_p99_ms']:.3f} ms"
+        if args.governor:
+            summary += f"  seconds per quality level {result['quality_level_seconds']}"
+        print(summary)
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {"seed": args.seed, "render": render, "scenarios": results}, file, indent=2
+        )
+    print(f"results written to {args.output}")
+
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as file:
+            thresholds = json.load(file)
+        if args.save_baseline:
+            save_baselines(results, thresholds)
+            with open(args.thresholds, "w") as file:
+                json.dump(thresholds, file, indent=2)
+                file.write("\n")
+            print(f"baselines written to {args.thresholds}")
+            return
+        failures = check_thresholds(results, thresholds)
+        if failures:
+            print("REGRESSION, over the limit:")
+            for failure in failures:
+                print("  " + failure)
+            sys.exit(1)
+        print("all thresholds passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import math
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from benchmark import aim_at_nearest_enemy, can_render, make_invincible, percentile
+from headless import HeadlessGame
+
+# Renders a seeded run off-screen and streams the frames to disk. draw() goes into the
+# game's own surface, a copy of it is handed to a writer thread through a bounded queue
+# and the thread turns it into a png or appends it to one raw rgb file. When the writer
+# falls behind frames are dropped instead of waiting on it, so the run and its timings
+# are the same with or without capture. With --golden every frame is compared against
+# the png of the same name in that folder instead, and then nothing is dropped: the run
+# fails if any frame is missing there or differs from it.
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(GAME_DIR, "captures")
+QUEUE_SIZE = 32
+# the bot leaves the upgrade cards up this long before it takes the first one, so they
+# end up in the frames too
+UPGRADE_DELAY = 60
+# frames kept after the game over screen comes up
+GAME_OVER_FRAMES = 60
+# about 80 kB a frame. Higher levels take twice as long for a little less
+PNG_LEVEL = 3
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def frame_name(tick):
+    return f"frame_{tick:06d}.png"
+
+
+def png_chunk(kind, data):
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def encode_png(pygame, frame):
+    # pygame.image.save holds the GIL for all of it, zlib lets go of it while it
+    # compresses, so the game keeps running next to the writer. 8 bit rgb, every row
+    # unfiltered
+    width, height = frame.get_size()
+    pixels = pygame.image.tobytes(frame, "RGB")
+    stride = width * 3
+    rows = b"".join(
+        b"\x00" + pixels[start : start + stride]
+        for start in range(0, len(pixels), stride)
+    )
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        PNG_SIGNATURE
+        + png_chunk(b"IHDR", header)
+        + png_chunk(b"IDAT", zlib.compress(rows, PNG_LEVEL))
+        + png_chunk(b"IEND", b"")
+    )
+
+
+def save_png(pygame, frame, path):
+    with open(path, "wb") as file:
+        file.write(encode_png(pygame, frame))
+
+
+class FrameWriter:
+    def __init__(
+        self,
+        directory,
+        image_format="png",
+        queue_size=QUEUE_SIZE,
+        golden=None,
+        update_golden=False,
+        tolerance=0,
+    ):
+        self.directory = directory
+        self.image_format = image_format
+        self.golden = golden
+        self.update_golden = update_golden
+        self.tolerance = tolerance
+        # golden frames are all checked, the others are dropped when the queue is full
+        self.block = golden is not None
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.raw_file = None
+        self.size = None
+        self.written = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+        self.mismatches = []
+        self.missing = []
+        self.error = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.golden is not None:
+            os.makedirs(self.golden, exist_ok=True)
+        self.thread.start()
+
+    def capture(self, surface, tick):
+        # a copy is a memcpy, the slow part of turning it into bytes or a png is left to
+        # the thread
+        frame = surface.copy()
+        self.size = frame.get_size()
+        try:
+            self.queue.put((tick, frame), block=self.block)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.high_water_mark = max(self.high_water_mark, self.queue.qsize())
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.raw_file is not None:
+            self.raw_file.close()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        import pygame
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep emptying the queue so the game never waits on a dead writer
+                continue
+            tick, frame = item
+            try:
+                if self.golden is not None:
+                    self.check_golden(pygame, tick, frame)
+                elif self.image_format == "png":
+                    save_png(pygame, frame, os.path.join(self.directory, frame_name(tick)))
+                else:
+                    self.write_raw(pygame, frame)
+            except Exception as error:
+                self.error = error
+                continue
+            self.written += 1
+
+    def write_raw(self, pygame, frame):
+        if self.raw_file is None:
+            self.raw_file = open(os.path.join(self.directory, "frames.rgb"), "wb")
+        self.raw_file.write(pygame.image.tobytes(frame, "RGB"))
+
+    def check_golden(self, pygame, tick, frame):
+        path = os.path.join(self.golden, frame_name(tick))
+        if self.update_golden:
+            save_png(pygame, frame, path)
+            return
+        if not os.path.exists(path):
+            self.missing.append(tick)
+            return
+        expected = pygame.image.tobytes(pygame.image.load(path), "RGB")
+        actual = pygame.image.tobytes(frame, "RGB")
+        if actual == expected:
+            return
+        different, largest = pixel_difference(expected, actual)
+        if largest > self.tolerance:
+            self.mismatches.append((tick, different, largest))
+            # keep what we got next to where it's going, to look at the two side by side
+            save_png(pygame, frame, os.path.join(self.directory, frame_name(tick)))
+
+
+def pixel_difference(expected, actual):
+    # how many pixels differ and by how much at most in one channel
+    if len(expected) != len(actual):
+        return math.inf, math.inf
+    try:
+        import numpy
+    except ImportError:
+        # without numpy every difference counts, however small
+        return math.nan, math.inf
+    difference = numpy.abs(
+        numpy.frombuffer(expected, numpy.uint8).astype(numpy.int16)
+        - numpy.frombuffer(actual, numpy.uint8)
+    ).reshape(-1, 3)
+    return int(numpy.count_nonzero(difference.max(axis=1))), int(difference.max())
+
+
+def play_slowly(game, waited):
+    # the benchmark bot, except that it looks at the upgrade cards for a while first
+    wave_manager = game.game_manager.wave_manager
+    if wave_manager.intermission and wave_manager.upgrades:
+        waited += 1
+        if waited > UPGRADE_DELAY:
+            game.choose_upgrade(0)
+            waited = 0
+    aim_at_nearest_enemy(game)
+    return waited
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a run off-screen to frames.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ticks", type=int, default=60 * 60 * 5, help="ticks to play")
+    parser.add_argument("--every", type=int, default=1, help="capture every n-th tick")
+    parser.add_argument("--format", choices=("png", "raw"), default="png")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE, help="frames in flight")
+    parser.add_argument("--endless", action="store_true", help="play endless mode")
+    parser.add_argument("--god", action="store_true", help="the player can't die")
+    parser.add_argument("--golden", help="compare against the frames in this folder")
+    parser.add_argument(
+        "--update-golden", action="store_true", help="write the --golden frames instead"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=0,
+        help="largest difference in one channel a golden frame may have",
+    )
+    args = parser.parse_args()
+    if args.update_golden and args.golden is None:
+        sys.exit("--update-golden needs --golden")
+    if not can_render():
+        sys.exit("capturing frames needs pygame and pgzero")
+
+    game = HeadlessGame(args.seed, render=True)
+    game_manager = game.game_manager
+    # frames have to come out the same on every machine, so no quality levels that
+    # depend on how fast this one is
+    game_manager.quality.enabled = False
+    game.start(args.endless)
+    if args.god:
+        make_invincible(game)
+
+    writer = FrameWriter(
+        args.output,
+        args.format,
+        args.queue,
+        args.golden,
+        args.update_golden,
+        args.tolerance,
+    )
+    writer.start()
+    draw_times = []
+    capture_times = []
+    waited = 0
+    game_over_frames = 0
+    started = time.perf_counter()
+    while game.ticks < args.ticks and game_over_frames < GAME_OVER_FRAMES:
+        if game_manager.game_over:
+            game_over_frames += 1
+        waited = play_slowly(game, waited)
+        game.step()
+        if game.ticks % args.every:
+            continue
+        drawn = time.perf_counter_ns()
+        game.draw()
+        copied = time.perf_counter_ns()
+        writer.capture(game.surface, game.ticks)
+        draw_times.append((copied - drawn) / 1e6)
+        capture_times.append((time.perf_counter_ns() - copied) / 1e6)
+    played = time.perf_counter() - started
+    writer.close()
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{game.ticks} ticks, {len(draw_times)} frames in {played:.2f}s"
+        f" (writer done after {elapsed:.2f}s)"
+    )
+    print(
+        f"draw p50 {percentile(draw_times, 50):.3f} ms"
+        f" p95 {percentile(draw_times, 95):.3f} ms"
+        f" p99 {percentile(draw_times, 99):.3f} ms,"
+        f" capture p95 {percentile(capture_times, 95):.3f} ms"
+    )
+    print(
+        f"{writer.written} written, {writer.dropped} dropped,"
+        f" at most {writer.high_water_mark} of {args.queue} queued"
+    )
+    if args.format == "raw" and args.golden is None and writer.size is not None:
+        width, height = writer.size
+        print(
+            f"ffmpeg -f rawvideo -pixel_format rgb24 -video_size {width}x{height}"
+            f" -framerate {round(60 / args.every)}"
+            f" -i {os.path.join(args.output, 'frames.rgb')} capture.mp4"
+        )
+    if args.golden is None or args.update_golden:
+        return
+    for tick, different, largest in writer.mismatches:
+        print(f"{frame_name(tick)}: {different} pixels differ, by up to {largest}")
+    if writer.missing:
+        print(
+            f"{len(writer.missing)} frames have no golden,"
+            f" the first is {frame_name(writer.missing[0])}"
+        )
+    if writer.mismatches or writer.missing:
+        sys.exit("frames differ from the golden ones")
+    print("every frame matches the golden ones")
+
+
+if __name__ == "__main__":
+    main()
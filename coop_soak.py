@@ -0,0 +1,122 @@
+import argparse
+import math
+import sys
+
+from batch_sim import kite_bot
+from benchmark import percentile, play_with_bot
+from headless import HeadlessGame
+
+# Co-op over loopback. A host and a client game run in this process and talk over a real
+# socket, the host played by the benchmark bot and the client by the kite bot. Neither
+# player can die, so endless mode keeps the crowd growing. Every minute of game time
+# prints how big the states got, what building them cost the host and applying them the
+# client, how far the client's enemies are from the host's, and how many ticks of input
+# the host is behind. Fails if a state ever went over the budget.
+
+# the header, both players, a wave part with upgrades and the counts, on top of the
+# enemy budget and the projectiles
+STATE_OVERHEAD = 128
+CONNECT_TICKS = 60
+
+
+def connect(seed):
+    host = HeadlessGame(seed)
+    client = HeadlessGame(seed + 1)
+    # port 0, the system picks a free one
+    coop = host.module.host_coop(("127.0.0.1", 0), endless=True)
+    client.module.join_coop(coop.address)
+    for _ in range(CONNECT_TICKS):
+        host.step()
+        client.step()
+        if client.game_manager.game_started:
+            return host, client
+    sys.exit("the client never got the start of the game")
+
+
+def position_error(host, client):
+    # the client applies the state the host sent this tick, so they should agree to a
+    # rounding of the positions unless some enemies didn't fit in it
+    known = client.game_manager.coop.enemies
+    error = 0
+    missing = 0
+    for enemy in host.game_manager.enemies:
+        seen = known.get(enemy.net_id)
+        if seen is None:
+            missing += 1
+            continue
+        error = max(error, abs(seen.x - enemy.x), abs(seen.y - enemy.y))
+    return error, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Co-op over loopback soak test.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--minutes", type=float, default=10, help="minutes of game time")
+    args = parser.parse_args()
+
+    host, client = connect(args.seed)
+    module = host.module
+    host_coop = host.game_manager.coop
+    client_coop = client.game_manager.coop
+    for player in host.game_manager.players():
+        player.current_health = math.inf
+    frames_per_minute = round(60 / host.tick_length)
+    total_frames = round(args.minutes * frames_per_minute)
+    limit = (
+        module.COOP_TICK_BUDGET
+        + module.COOP_MAX_PROJECTILES * module.PROJECTILE_STATE.size
+        + STATE_OVERHEAD
+    )
+
+    print(
+        "minute  wave  enemies  state p50  state max    out kB/s"
+        "  encode p95  apply p95  max error  missing  input lag"
+    )
+    state_sizes = []
+    encode_times = []
+    apply_times = []
+    largest_state = 0
+    worst_error = 0
+    worst_lag = 0
+    while host.ticks < total_frames:
+        if host.game_manager.coop is None or client.game_manager.coop is None:
+            sys.exit("the connection dropped")
+        play_with_bot(host)
+        host.step()
+        kite_bot(client)
+        client.step()
+
+        state_sizes.append(host_coop.stats.state_bytes)
+        encode_times.append(host_coop.encode_time * 1000)
+        apply_times.append(client_coop.apply_time * 1000)
+        error, missing = position_error(host, client)
+        lag = client_coop.sequence - host_coop.acknowledged
+        worst_error = max(worst_error, error)
+        worst_lag = max(worst_lag, lag)
+
+        if host.ticks % frames_per_minute == 0:
+            largest_state = max(largest_state, max(state_sizes))
+            print(
+                f"{host.ticks // frames_per_minute:>6}"
+                f"  {host.game_manager.wave_manager.current_wave:>4}"
+                f"  {len(host.game_manager.enemies):>7}"
+                f"  {percentile(state_sizes, 50):>7} B  {max(state_sizes):>7} B"
+                f"  {host_coop.stats.sent_per_second / 1024:>10.1f}"
+                f"  {percentile(encode_times, 95):>7.3f} ms"
+                f"  {percentile(apply_times, 95):>6.3f} ms"
+                f"  {error:>6.3f} px  {missing:>7}  {lag:>9}"
+            )
+            state_sizes = []
+            encode_times = []
+            apply_times = []
+
+    print(
+        f"largest state {largest_state} bytes (limit {limit}), client enemies at most"
+        f" {worst_error:.3f} px off, input at most {worst_lag} ticks behind"
+    )
+    if largest_state > limit:
+        sys.exit("a state went over the budget")
+
+
+if __name__ == "__main__":
+    main()
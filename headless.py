@@ -0,0 +1,477 @@
+import math
+import os
+import random
+import struct
+import sys
+import time
+import types
+
+# Runs the game logic from main.py without Pygame Zero or a window. We load main.py the
+# same way pgzrun does, but fill its globals with the stand-ins below instead of the real
+# Actor, keyboard, sounds, music, animate and screen. Then update() can be called
+# on a fixed tick as fast as the CPU allows, with a seeded Random for reproducible runs.
+
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+GAME_PATH = os.path.join(GAME_DIR, "main.py")
+IMAGES_DIR = os.path.join(GAME_DIR, "images")
+
+TICK = 1 / 60
+
+
+def read_png_size(path):
+    # width and height sit right after the signature, in the IHDR chunk
+    with open(path, "rb") as file:
+        header = file.read(24)
+    return struct.unpack(">II", header[16:24])
+
+
+def load_image_sizes():
+    sizes = {}
+    for file_name in os.listdir(IMAGES_DIR):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".png":
+            sizes[name] = read_png_size(os.path.join(IMAGES_DIR, file_name))
+    return sizes
+
+
+IMAGE_SIZES = load_image_sizes()
+
+
+class HeadlessSurface:
+    def __init__(self, size):
+        self.size = size
+
+    def get_size(self):
+        return self.size
+
+
+class HeadlessImages:
+    def __init__(self):
+        self.cache = {}
+
+    def load(self, name):
+        surface = self.cache.get(name)
+        if surface is None:
+            if name not in IMAGE_SIZES:
+                raise KeyError(f"No image found like '{name}'")
+            surface = self.cache[name] = HeadlessSurface(IMAGE_SIZES[name])
+        return surface
+
+    def __getattr__(self, name):
+        return self.load(name)
+
+
+images = HeadlessImages()
+
+
+class HeadlessActor:
+    # only the parts of pgzero's Actor the game uses, always anchored on the center. The
+    # position is kept as a top left corner plus the anchor and every sum is done the way
+    # pgzero does it, so positions match the real game bit for bit and replays line up
+
+    def __init__(self, image, pos=None):
+        self.left = self.top = 0
+        self.width = self.height = 0
+        self._anchor = (0, 0)
+        self.image = image
+        if pos:
+            self.pos = pos
+
+    @property
+    def image(self):
+        return self._image_name
+
+    @image.setter
+    def image(self, image):
+        self._image_name = image
+        self._orig_surf = self._surf = images.load(image)
+        pos = self.pos
+        self.width, self.height = self._surf.get_size()
+        self._anchor = (self.width * 0.5, self.height * 0.5)
+        self.pos = pos
+
+    @property
+    def pos(self):
+        return self.left + self._anchor[0], self.top + self._anchor[1]
+
+    @pos.setter
+    def pos(self, pos):
+        self.left = pos[0] - self._anchor[0]
+        self.top = pos[1] - self._anchor[1]
+
+    @property
+    def x(self):
+        return self.left + self._anchor[0]
+
+    @x.setter
+    def x(self, x):
+        self.left = x - self._anchor[0]
+
+    @property
+    def y(self):
+        return self.top + self._anchor[1]
+
+    @y.setter
+    def y(self, y):
+        self.top = y - self._anchor[1]
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    @property
+    def topleft(self):
+        return self.left, self.top
+
+    def collidepoint(self, pos):
+        return (
+            self.left <= pos[0] < self.left + self.width
+            and self.top <= pos[1] < self.top + self.height
+        )
+
+    def distance_to(self, target):
+        target_x, target_y = target.pos if isinstance(target, HeadlessActor) else target
+        x, y = self.pos
+        dx = target_x - x
+        dy = target_y - y
+        return math.sqrt(dx * dx + dy * dy)
+
+    def draw(self):
+        pass
+
+
+# the same numbers pygame uses, so the keys in a recording mean the same thing here
+KEY_CODES = {
+    "ESCAPE": 27,
+    "SPACE": 32,
+    "RIGHT": 1073741903,
+    "LEFT": 1073741904,
+    "DOWN": 1073741905,
+    "UP": 1073741906,
+}
+KEY_F1 = 1073741882
+
+
+def key_code(name):
+    if len(name) == 1:
+        return ord(name.lower())
+    if name[0] == "F" and name[1:].isdigit():
+        return KEY_F1 + int(name[1:]) - 1
+    return KEY_CODES[name]
+
+
+class Keys:
+    # keys.A is the key's number, same as pgzero's
+    def __getattr__(self, name):
+        return key_code(name)
+
+
+class Keyboard:
+    # keeps the numbers of what's held down, pressed and released by name or number
+    def __init__(self):
+        self.pressed = set()
+
+    def __getitem__(self, key):
+        return key in self.pressed
+
+    def __getattr__(self, name):
+        return key_code(name.upper()) in self.pressed
+
+    def press(self, key):
+        self.pressed.add(key_code(key) if isinstance(key, str) else key)
+
+    def release(self, key):
+        self.pressed.discard(key_code(key) if isinstance(key, str) else key)
+
+
+class SilentSound:
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+    def get_num_channels(self):
+        return 0
+
+
+class SilentSounds:
+    def __getattr__(self, name):
+        return SilentSound()
+
+    def load(self, name):
+        return SilentSound()
+
+
+class SilentMusic:
+    def play(self, name):
+        pass
+
+    def play_once(self, name):
+        pass
+
+    def queue(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def unpause(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+    def is_playing(self, name):
+        return False
+
+
+def animate(target, tween="linear", duration=1, on_finished=None, **targets):
+    # nobody is looking, so every tween jumps straight to its end
+    for attribute, value in targets.items():
+        setattr(target, attribute, value)
+    if on_finished is not None:
+        on_finished()
+
+
+class Rect:
+    def __init__(self, topleft, size):
+        self.x, self.y = topleft
+        self.width, self.height = size
+
+    @property
+    def topleft(self):
+        return self.x, self.y
+
+
+class NullDraw:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class NullScreen:
+    def __init__(self):
+        self.draw = NullDraw()
+        self.surface = None
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def headless_exit():
+    raise SystemExit
+
+
+def make_builtins(keyboard):
+    return {
+        "Actor": HeadlessActor,
+        "images": images,
+        "Rect": Rect,
+        "keyboard": keyboard,
+        "keys": Keys(),
+        "sounds": SilentSounds(),
+        "music": SilentMusic(),
+        "animate": animate,
+        "screen": NullScreen(),
+        "exit": headless_exit,
+    }
+
+
+def make_render_builtins(visible=False):
+    # real pgzero Actors and screen drawing into a surface of our own, so draw() costs
+    # what it costs in the game and every game has its own picture. Input, sound and time
+    # are still ours
+    if not visible:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    import pgzero.game
+    import pgzero.loaders
+    import pgzero.screen
+    from pgzero.actor import Actor
+    from pgzero.loaders import images
+    from pgzero.rect import Rect
+
+    pygame.display.init()
+    pgzero.loaders.set_root(GAME_PATH)
+    # images are converted on load, which needs a display mode. main.py resizes it later
+    surface = pygame.display.set_mode((100, 100))
+    pgzero.game.screen = surface
+    return {
+        "Actor": Actor,
+        "images": images,
+        "Rect": Rect,
+        "screen": pgzero.screen.Screen(surface),
+    }
+
+
+def resize_render_screen(module, visible=False):
+    import pygame
+    import pgzero.game
+
+    size = (module.WIDTH, module.HEIGHT)
+    if visible:
+        surface = pygame.display.set_mode(size)
+    else:
+        # off-screen, in the display's pixel format so blits cost the same as on it
+        surface = pygame.Surface(size).convert()
+    pgzero.game.screen = surface
+    module.screen.surface = surface
+    module.screen.width, module.screen.height = size
+    return surface
+
+
+class HeadlessGame:
+    # with numpy=False main.py is loaded as if numpy wasn't installed, so it runs the plain
+    # python pools instead of the numpy stores
+    def __init__(self, seed=None, tick=TICK, render=False, visible=False, numpy=True):
+        self.keyboard = Keyboard()
+        self.tick_length = tick
+        self.ticks = 0
+        self.render = render
+        self.surface = None
+
+        # the same steps pgzrun takes, just with our globals instead of pgzero's
+        module = types.ModuleType("main")
+        module.__file__ = GAME_PATH
+        module.__dict__.update(make_builtins(self.keyboard))
+        if render:
+            module.__dict__.update(make_render_builtins(visible))
+        with open(GAME_PATH) as file:
+            code = compile(file.read(), GAME_PATH, "exec")
+        loaded_numpy = sys.modules.get("numpy")
+        if not numpy:
+            # a None entry makes the import fail, for this one exec
+            sys.modules["numpy"] = None
+        try:
+            exec(code, module.__dict__)
+        finally:
+            if not numpy:
+                if loaded_numpy is None:
+                    del sys.modules["numpy"]
+                else:
+                    sys.modules["numpy"] = loaded_numpy
+        if render:
+            self.surface = resize_render_screen(module, visible)
+        self.module = module
+        self.game_manager = module.game_manager
+        self.game_manager.rng = random.Random(seed)
+
+    def start(self, endless=False):
+        self.module.start_game(endless)
+
+    def snapshot(self):
+        return self.module.take_snapshot()
+
+    def restore(self, snapshot):
+        self.module.restore_snapshot(snapshot)
+
+    def step(self, dt=None):
+        if dt is None:
+            dt = self.tick_length
+        self.module.update(dt)
+        self.ticks += 1
+
+    def draw(self):
+        if self.render:
+            import pgzero.game
+
+            # Actor.draw() blits to pgzero's one global screen, point it at our surface
+            # in case another game in this process drew since
+            pgzero.game.screen = self.surface
+        self.module.draw()
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+    # with until_wave it stops as soon as that wave has started
+    def run_until_game_over(self, max_ticks, pick_upgrade=0, until_wave=None):
+        game_manager = self.game_manager
+        while self.ticks < max_ticks and not game_manager.game_over:
+            wave_manager = game_manager.wave_manager
+            if wave_manager is not None and wave_manager.intermission:
+                self.choose_upgrade(pick_upgrade)
+            if until_wave is not None and wave_manager.current_wave >= until_wave:
+                return
+            self.step()
+
+    def choose_upgrade(self, index):
+        upgrade = self.game_manager.wave_manager.upgrades[index]
+        self.module.on_mouse_down(upgrade.pos)
+
+    def aim(self, pos):
+        self.module.on_mouse_move(pos, (0, 0), set())
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play a whole run without a window.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--ticks", type=int, default=60 * 60 * 10)
+    parser.add_argument("--god", action="store_true", help="the player can't die")
+    parser.add_argument("--endless", action="store_true", help="play endless mode")
+    parser.add_argument("--profile", action="store_true", help="run under cProfile")
+    parser.add_argument("--from-snapshot", help="start from this snapshot instead")
+    parser.add_argument(
+        "--save-snapshot", help="stop when --at-wave starts and save a snapshot here"
+    )
+    parser.add_argument("--at-wave", type=int, default=5)
+    parser.add_argument(
+        "--no-numpy", action="store_true", help="run as if numpy wasn't installed"
+    )
+    args = parser.parse_args()
+
+    game = HeadlessGame(args.seed, numpy=not args.no_numpy)
+    if args.from_snapshot:
+        with open(args.from_snapshot, "rb") as file:
+            game.restore(file.read())
+    else:
+        game.start(args.endless)
+    if args.god:
+        game.game_manager.player.current_health = math.inf
+    until_wave = args.at_wave if args.save_snapshot else None
+
+    started = time.perf_counter()
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.runcall(game.run_until_game_over, args.ticks, 0, until_wave)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(25)
+    else:
+        game.run_until_game_over(args.ticks, until_wave=until_wave)
+    elapsed = time.perf_counter() - started
+    if args.save_snapshot:
+        if game.game_manager.wave_manager.current_wave < args.at_wave:
+            sys.exit(f"the run ended before wave {args.at_wave}, try --god")
+        with open(args.save_snapshot, "wb") as file:
+            file.write(game.snapshot())
+        print("snapshot saved to", args.save_snapshot)
+
+    game_manager = game.game_manager
+    print(
+        f"ticks: {game.ticks} ({game.ticks * game.tick_length:.0f}s of game time)"
+        f" in {elapsed:.2f}s"
+    )
+    print(
+        f"wave: {game_manager.wave_manager.current_wave}"
+        f" health: {game_manager.player.current_health}"
+        f" game over: {game_manager.game_over}"
+    )
+
+
+if __name__ == "__main__":
+    main()
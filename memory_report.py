@@ -0,0 +1,159 @@
+import argparse
+import gc
+import math
+import tracemalloc
+
+from benchmark import freeze_waves, make_invincible, play_with_bot
+from headless import HeadlessGame
+
+# What a crowd costs in memory. First a big batch of enemies and one of projectiles get
+# spawned into an empty arena, and tracemalloc says what one of each takes with everything
+# it brings along: the entity or its store row, the pool and list entries, the state of a
+# frame of play. Then a run where the player can't die and the benchmark bot plays, with
+# the biggest crowd of every wave and what it takes. At the end what --budget enemies and
+# as many projectiles would take, to see how far off six figures are.
+
+SAMPLE_SIZE = 5000
+BUDGET = 100000
+MAX_TICKS = 60 * 60 * 60
+
+
+def traced_bytes(spawn, game, amount):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        spawn(amount)
+        # one frame, so whatever an entity only gets once it moves is counted too
+        game.step()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / amount
+
+
+def quiet_arena(seed):
+    game = HeadlessGame(seed)
+    game.start()
+    make_invincible(game)
+    freeze_waves(game)
+    player = game.game_manager.player
+    player.damage = 0
+    player.can_shoot = False
+    return game
+
+
+def bytes_per_enemy(seed, amount):
+    game = quiet_arena(seed)
+    game_manager = game.game_manager
+    wave_manager = game_manager.wave_manager
+    enemy_type = next(iter(game.module.ENEMY_TYPES))
+    width = game.module.WIDTH
+
+    def spawn(count):
+        # spread out in rows above the screen, so they don't all land in one cell
+        for index in range(count):
+            wave_manager.add_enemy(enemy_type, (index % width, -40 - index // width * 40))
+
+    # use up what the pool made in advance, otherwise those enemies would come for free
+    spawn(len(game_manager.enemy_pool.free))
+    return traced_bytes(spawn, game, amount)
+
+
+def bytes_per_projectile(seed, amount):
+    game = quiet_arena(seed)
+    game_manager = game.game_manager
+    player = game_manager.player
+
+    def spawn(count):
+        for index in range(count):
+            angle = 2 * math.pi * index / count
+            game_manager.spawn_projectile(
+                player.pos, player.shot_speed, (math.cos(angle), math.sin(angle)), 1
+            )
+
+    if game_manager.projectile_store is None:
+        spawn(len(game_manager.projectile_pool.free))
+    return traced_bytes(spawn, game, amount)
+
+
+def store_bytes(game_manager):
+    total = 0
+    stores = (
+        game_manager.enemy_store,
+        game_manager.projectile_store,
+        game_manager.particles,
+    )
+    for store in stores:
+        if store is not None:
+            total += store.nbytes()
+    return total
+
+
+def kilobytes(amount):
+    return f"{amount / 1024:.1f} kB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per entity and per wave.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sample", type=int, default=SAMPLE_SIZE, help="entities to measure")
+    parser.add_argument("--waves", type=int, default=5, help="waves to play")
+    parser.add_argument("--endless", action="store_true", help="play endless mode")
+    parser.add_argument(
+        "--budget", type=int, default=BUDGET, help="crowd size for the projection"
+    )
+    args = parser.parse_args()
+
+    enemy_bytes = bytes_per_enemy(args.seed, args.sample)
+    projectile_bytes = bytes_per_projectile(args.seed, args.sample)
+
+    game = HeadlessGame(args.seed)
+    game.start(endless=args.endless)
+    make_invincible(game)
+    game_manager = game.game_manager
+    layout = []
+    if game_manager.enemy_store is not None:
+        layout.append("enemies in the numpy store")
+    if game_manager.projectile_store is not None:
+        layout.append("projectiles in the numpy store")
+    print(", ".join(layout) or "no numpy, every entity pooled")
+    print(f"bytes per enemy: {enemy_bytes:.0f}")
+    print(f"bytes per projectile: {projectile_bytes:.0f}")
+    print()
+    print("wave  peak enemies  peak projectiles   crowd at peak   store arrays")
+
+    waves = []
+    wave = None
+    peak_enemies = peak_projectiles = 0
+    while game.ticks < MAX_TICKS:
+        wave_manager = game_manager.wave_manager
+        if wave_manager.current_wave != wave or game_manager.game_over:
+            if wave is not None:
+                crowd = peak_enemies * enemy_bytes + peak_projectiles * projectile_bytes
+                waves.append(crowd)
+                print(
+                    f"{wave:>4}  {peak_enemies:>12}  {peak_projectiles:>16}"
+                    f"  {kilobytes(crowd):>14}  {kilobytes(store_bytes(game_manager)):>13}"
+                )
+            wave = wave_manager.current_wave
+            peak_enemies = peak_projectiles = 0
+            if game_manager.game_over or wave > args.waves:
+                break
+        play_with_bot(game)
+        game.step()
+        peak_enemies = max(peak_enemies, len(game_manager.enemies))
+        peak_projectiles = max(peak_projectiles, len(game_manager.projectiles))
+
+    if waves:
+        print(f"biggest crowd: {kilobytes(max(waves))}")
+    budget = args.budget * (enemy_bytes + projectile_bytes)
+    print(
+        f"{args.budget} enemies and {args.budget} projectiles:"
+        f" {budget / 1024 / 1024:.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
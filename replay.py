@@ -0,0 +1,146 @@
+import argparse
+import os
+import struct
+import sys
+import time
+
+from headless import HeadlessGame
+
+# Plays a recording made with F5 back through update() with the recorded dt of every
+# tick, as fast as the CPU allows. The game ends up in the same state as the recorded run,
+# which the checksum stored in the recording confirms, so a slow run can be replayed
+# under a profiler as often as needed.
+#
+# With --from-wave the replay skips straight to that wave. The first time it plays up to
+# it and saves a snapshot next to the recording, after that it restores the snapshot and
+# only replays the ticks from there on.
+
+# the snapshot file starts with the index of the tick to go on from
+SNAPSHOT_TICK_FORMAT = struct.Struct("<Q")
+
+
+def apply_tick(game, tick):
+    # everything the player did before this tick's update, then the tick length to use
+    dt, buttons, mouse, events = tick
+    game_manager = game.game_manager
+    game_manager.controls.buttons = buttons
+    game_manager.mouse_pos = mouse
+    for kind, value in events:
+        if kind == game.module.EVENT_MOUSE_DOWN:
+            game.module.on_mouse_down(value)
+        else:
+            game.module.on_key_down(value)
+    return dt
+
+
+def start_replay(recording, render=False, visible=False):
+    game = HeadlessGame(recording.seed, render=render, visible=visible)
+    game.game_manager.controls.locked = True
+    game.start(recording.endless)
+    return game
+
+
+def finish_checksum(game):
+    # a run that ended in a restart was checked right before the reset
+    checksum = game.game_manager.last_run_checksum
+    return checksum if checksum is not None else game.module.state_checksum()
+
+
+def wave_snapshot_path(path, wave):
+    return f"{os.path.splitext(path)[0]}.wave{wave}.snap"
+
+
+def snapshot_at_wave(recording, wave):
+    # (tick index, snapshot) right after the wave started, None if it never did
+    game = start_replay(recording)
+    for tick in recording.ticks:
+        game.step(apply_tick(game, tick))
+        wave_manager = game.game_manager.wave_manager
+        if (
+            wave_manager is not None
+            and wave_manager.current_wave >= wave
+            and not wave_manager.intermission
+        ):
+            return game.ticks, game.snapshot()
+    return None
+
+
+def load_wave_snapshot(path, recording, wave):
+    snapshot_path = wave_snapshot_path(path, wave)
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "rb") as file:
+            data = file.read()
+        (tick,) = SNAPSHOT_TICK_FORMAT.unpack_from(data)
+        return tick, data[SNAPSHOT_TICK_FORMAT.size :]
+    start = snapshot_at_wave(recording, wave)
+    if start is not None:
+        with open(snapshot_path, "wb") as file:
+            file.write(SNAPSHOT_TICK_FORMAT.pack(start[0]) + start[1])
+    return start
+
+
+def replay(recording, render=False, visible=False, start=None):
+    game = start_replay(recording, render, visible)
+    if start is not None:
+        game.ticks, snapshot = start
+        game.restore(snapshot)
+    if visible:
+        import pygame
+    for tick in recording.ticks[game.ticks :]:
+        game.step(apply_tick(game, tick))
+        if render:
+            game.draw()
+            if visible:
+                pygame.event.pump()
+                pygame.display.flip()
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded run at full speed.")
+    parser.add_argument("recording")
+    parser.add_argument("--render", action="store_true", help="call draw() every tick")
+    parser.add_argument("--show", action="store_true", help="render into a real window")
+    parser.add_argument("--profile", action="store_true", help="run under cProfile")
+    parser.add_argument(
+        "--from-wave", type=int, help="start from a snapshot of when this wave started"
+    )
+    args = parser.parse_args()
+    render = args.render or args.show
+
+    # the format lives in main.py, so read it through a game module
+    recording = HeadlessGame().module.load_recording(args.recording)
+    start = None
+    if args.from_wave is not None:
+        start = load_wave_snapshot(args.recording, recording, args.from_wave)
+        if start is None:
+            sys.exit(f"the recorded run never gets to wave {args.from_wave}")
+
+    started = time.perf_counter()
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        game = profiler.runcall(replay, recording, render, args.show, start)
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(25)
+    else:
+        game = replay(recording, render, args.show, start)
+    elapsed = time.perf_counter() - started
+
+    replayed = recording.ticks[start[0] if start is not None else 0 :]
+    ticks = len(replayed)
+    game_time = sum(tick[0] for tick in replayed)
+    print(
+        f"ticks: {ticks} ({game_time:.0f}s of game time) in {elapsed:.2f}s"
+        f" ({ticks / max(elapsed, 1e-9):.0f} ticks/s)"
+    )
+    if finish_checksum(game) == recording.checksum:
+        print("replay matches the recording")
+    else:
+        print("replay DIVERGED from the recording")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import gc
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmark import aim_at_nearest_enemy, can_render, percentile
+from headless import HeadlessGame
+
+# Endless mode as a soak test. One long endless run where the player can't die and a bot
+# aims at the nearest enemy and takes the first upgrade, so the waves and the crowd keep
+# growing. Every minute of game time prints how big the crowd is, what update() and draw()
+# cost and how much memory is in use. At the end: how long it held 60 fps, and how fast
+# memory grew once warmed up. That's a straight line fitted through the resident memory of
+# every minute after the warm-up, and more than --max-growth MB a minute fails the run.
+
+FRAME_BUDGET_MS = 1000 / 60
+# a minute counts as holding 60 fps while this many of its frames fit the budget
+HOLD_PERCENTILE = 95
+
+
+# the pools and stores grow with the biggest crowd so far, a few kB an enemy, so a growing
+# crowd stays well under this. A leak of one small object a frame doesn't
+MAX_GROWTH_MB_PER_MINUTE = 1.0
+WARMUP_MINUTES = 5
+
+
+def resident_mb():
+    # python objects plus the numpy arrays, as the system sees it right now. Linux only
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def memory_in_use():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0] / 2**20
+    return resident_mb()
+
+
+def slope(points):
+    # least squares, MB per minute
+    count = len(points)
+    mean_x = sum(x for x, _ in points) / count
+    mean_y = sum(y for _, y in points) / count
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endless mode soak test.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--minutes", type=float, default=60, help="minutes of game time")
+    parser.add_argument("--no-render", action="store_true", help="skip timing draw()")
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=WARMUP_MINUTES,
+        help="minutes left out of the memory growth",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=MAX_GROWTH_MB_PER_MINUTE,
+        help="MB a minute memory may grow by after the warm-up",
+    )
+    args = parser.parse_args()
+
+    if resident_mb() is None:
+        # slows every frame down, so the timings are worse than they'd really be
+        print("no /proc here, memory is what tracemalloc sees and the timings are slower")
+        tracemalloc.start()
+
+    render = not args.no_render and can_render()
+    game = HeadlessGame(args.seed, render=render)
+    game.start(endless=True)
+    game_manager = game.game_manager
+    game_manager.player.current_health = math.inf
+    frames_per_minute = round(60 / game.tick_length)
+    total_frames = round(args.minutes * frames_per_minute)
+
+    print(
+        "minute  wave  enemies  projectiles  update p95  draw p95  over budget"
+        "  python blocks  memory mb"
+    )
+    minutes = []
+    frame_times = []
+    update_times = []
+    draw_times = []
+    started = time.perf_counter()
+    while game.ticks < total_frames:
+        wave_manager = game_manager.wave_manager
+        if wave_manager.intermission and wave_manager.upgrades:
+            game.choose_upgrade(0)
+        aim_at_nearest_enemy(game)
+
+        frame_started = time.perf_counter_ns()
+        game.step()
+        updated = time.perf_counter_ns()
+        if render:
+            game.draw()
+        drawn = time.perf_counter_ns()
+        update_times.append((updated - frame_started) / 1e6)
+        draw_times.append((drawn - updated) / 1e6)
+        frame_times.append((drawn - frame_started) / 1e6)
+
+        if game.ticks % frames_per_minute == 0:
+            # collect first, so only memory that's still held counts
+            gc.collect()
+            blocks = sys.getallocatedblocks()
+            memory = memory_in_use()
+            minute = {
+                "minute": game.ticks // frames_per_minute,
+                "wave": wave_manager.current_wave,
+                "enemies": len(game_manager.enemies),
+                "projectiles": len(game_manager.projectiles),
+                "update_p95_ms": percentile(update_times, 95),
+                "draw_p95_ms": percentile(draw_times, 95),
+                "over_budget": sum(1 for ms in frame_times if ms > FRAME_BUDGET_MS),
+                "frame_hold_ms": percentile(frame_times, HOLD_PERCENTILE),
+                "blocks": blocks,
+                "memory_mb": memory,
+            }
+            minutes.append(minute)
+            print(
+                f"{minute['minute']:>6}  {minute['wave']:>4}  {minute['enemies']:>7}"
+                f"  {minute['projectiles']:>11}  {minute['update_p95_ms']:>7.2f} ms"
+                f"  {minute['draw_p95_ms']:>5.2f} ms  {minute['over_budget']:>11}"
+                f"  {blocks:>13}  {memory:>9.1f}"
+            )
+            frame_times = []
+            update_times = []
+            draw_times = []
+    elapsed = time.perf_counter() - started
+
+    print(f"played {game.ticks / frames_per_minute:.1f} minutes in {elapsed:.0f}s")
+    if not minutes:
+        return
+    held = None
+    for minute in minutes:
+        if minute["frame_hold_ms"] > FRAME_BUDGET_MS:
+            break
+        held = minute
+    if held is None:
+        print("never held 60 fps for a whole minute")
+    elif held is minutes[-1]:
+        print(f"held 60 fps the whole run, up to {held['enemies']} enemies at once")
+    else:
+        print(
+            f"held 60 fps for {held['minute']} minutes, up to wave {held['wave']}"
+            f" with {held['enemies']} enemies"
+        )
+    warmed_up = [
+        (minute["minute"], minute["memory_mb"])
+        for minute in minutes
+        if minute["minute"] > args.warmup
+    ]
+    if len(warmed_up) < 2:
+        print("too short to tell how memory grows, needs 2 minutes past the warm-up")
+        return
+    growth = slope(warmed_up)
+    print(
+        f"memory grew {growth:.3f} MB a minute over minutes {warmed_up[0][0]}"
+        f"-{warmed_up[-1][0]}, {warmed_up[0][1]:.1f} to {warmed_up[-1][1]:.1f} MB"
+    )
+    if growth > args.max_growth:
+        sys.exit(f"LEAK, memory grows faster than {args.max_growth} MB a minute")
+
+
+if __name__ == "__main__":
+    main()
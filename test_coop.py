@@ -0,0 +1,14 @@
+import socket
+
+from headless import HeadlessGame
+
+
+def test_a_port_in_use_shows_up_on_screen():
+    game = HeadlessGame(1)
+    with socket.create_server(("127.0.0.1", 0)) as taken:
+        assert game.module.host_coop(taken.getsockname()) is None
+    message = game.game_manager.message
+    assert message.startswith("can't host co-op")
+    # gone again after a while, without touching the run
+    game.run(round(game.module.MESSAGE_SECONDS / game.tick_length) + 1)
+    assert game.game_manager.message is None
@@ -0,0 +1,71 @@
+import math
+import random
+
+import pytest
+
+from headless import HeadlessGame
+from replay import finish_checksum, replay
+
+# a couple of minutes of play at most, the first waves are over well before that
+WAVE_TICKS = 10000
+
+
+def play(game):
+    wave_manager = game.game_manager.wave_manager
+    if wave_manager.intermission:
+        game.choose_upgrade(0)
+    for enemy in game.game_manager.enemies:
+        if enemy.current_health > 0:
+            game.aim(enemy.pos)
+            break
+    game.step()
+
+
+def test_numpy_stores_play_the_same_run_as_python():
+    games = [HeadlessGame(1), HeadlessGame(1, numpy=False)]
+    assert games[0].game_manager.enemy_store is not None
+    assert games[1].game_manager.enemy_store is None
+    assert games[1].game_manager.projectile_store is None
+    for game in games:
+        game.start()
+        game.game_manager.player.current_health = math.inf
+    wave_manager = games[1].game_manager.wave_manager
+    # the first two waves and the upgrade between them, every tick exactly the same
+    for tick in range(WAVE_TICKS):
+        if wave_manager.current_wave > 2:
+            break
+        for game in games:
+            play(game)
+        with_numpy, without = (game.module.state_checksum() for game in games)
+        assert with_numpy == without, tick
+    assert wave_manager.current_wave > 2
+
+
+def test_recording_replays_to_its_checksum(tmp_path):
+    game = HeadlessGame(5)
+    game.module.RECORDING_DIR = str(tmp_path)
+    game_manager = game.game_manager
+    game_manager.recording_enabled = True
+    game.start()
+    # uneven frames and keys held for a while, the way a real session comes in
+    rolls = random.Random(5)
+    while game.ticks < 1200 and not game_manager.game_over:
+        if game.ticks % 90 == 0:
+            game.keyboard.pressed.clear()
+            game.keyboard.press(rolls.choice("WASD"))
+        wave_manager = game_manager.wave_manager
+        if wave_manager.intermission:
+            game.choose_upgrade(0)
+        if game_manager.enemies:
+            game.aim(game_manager.enemies[0].pos)
+        game.step(rolls.uniform(0.01, 0.03))
+    path = game_manager.stop_recording()
+    assert game_manager.message.startswith("recording saved to")
+
+    recording = game.module.load_recording(path)
+    assert len(recording.ticks) == game.ticks
+    assert finish_checksum(replay(recording)) == recording.checksum
+
+    # like a snapshot, a recording only plays back with the numpy setup it was made with
+    with pytest.raises(ValueError, match="numpy setup"):
+        HeadlessGame(numpy=False).module.load_recording(path)
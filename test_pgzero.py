@@ -0,0 +1,18 @@
+import pytest
+
+from headless import HeadlessGame
+
+
+def test_pgzrun_finds_nothing_to_warn_about():
+    spellcheck = pytest.importorskip("pgzero.spellcheck")
+    warnings = []
+
+    class Result(spellcheck.SpellCheckResult):
+        def warn(self, message, found, suggestion):
+            warnings.append(message.format(found=found, suggestion=suggestion))
+
+        def error(self, message, found, suggestion):
+            warnings.append(message.format(found=found, suggestion=suggestion))
+
+    spellcheck.spellcheck(HeadlessGame().module.__dict__, Result())
+    assert warnings == []
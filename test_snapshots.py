@@ -0,0 +1,45 @@
+import math
+
+from headless import HeadlessGame
+
+# python -m pytest from this folder runs these, they only need the game logic
+
+
+def test_restore_keeps_the_game_muted():
+    game = HeadlessGame(1)
+    game.start()
+    game_manager = game.game_manager
+    game.run(60)
+    assert game_manager.wave_snapshot is not None
+    game_manager.muted = True
+    # F8 restarts the wave, F6 and F7 save and load the same way underneath
+    game.module.on_key_down(game.module.keys.F8)
+    assert game_manager.game_started
+    assert game_manager.muted
+    game.restore(game.snapshot())
+    assert game_manager.muted
+
+
+def test_restore_picks_up_where_the_snapshot_was_taken():
+    game = HeadlessGame(3)
+    game.start()
+    game.game_manager.player.current_health = math.inf
+    game.run(600)
+    snapshot = game.snapshot()
+    game.run(600)
+    checksum = game.module.state_checksum()
+    game.restore(snapshot)
+    game.run(600)
+    assert game.module.state_checksum() == checksum
+
+
+def test_f6_says_where_the_snapshot_went(tmp_path):
+    game = HeadlessGame(2)
+    module = game.module
+    module.SNAPSHOT_DIR = str(tmp_path)
+    module.QUICKSAVE_PATH = str(tmp_path / "quicksave.snap")
+    game.start()
+    game.run(60)
+    module.on_key_down(module.keys.F6)
+    assert (tmp_path / "quicksave.snap").exists()
+    assert game.game_manager.message.startswith("snapshot saved to")
@@ -0,0 +1,18 @@
+import pytest
+
+from headless import HeadlessGame
+
+
+def test_unknown_resources_are_rejected():
+    scheduler = HeadlessGame().module.SystemScheduler()
+    with pytest.raises(ValueError):
+        scheduler.add("typo", lambda dt: None, reads=("enemy",))
+
+
+def test_systems_run_in_the_order_they_were_added():
+    scheduler = HeadlessGame().module.SystemScheduler()
+    ran = []
+    for name in ("steering", "collisions", "projectiles"):
+        scheduler.add(name, lambda dt, name=name: ran.append((name, dt)), reads=(name,))
+    scheduler.run(0.5)
+    assert ran == [("steering", 0.5), ("collisions", 0.5), ("projectiles", 0.5)]